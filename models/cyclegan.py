@@ -1,29 +1,94 @@
+import os
+import tempfile
+from functools import partial
+# has to be set before TensorFlow loads cuDNN
+os.environ.setdefault("TF_ENABLE_CUDNN_FRONTEND", "1")
+
 import tensorflow as tf
 from tensorflow.keras import Model
-from tensorflow.keras.layers import Layer, Conv2D, BatchNormalization, LeakyReLU,\
-    ReLU, Conv2DTranspose, Dropout, concatenate, ZeroPadding2D, Input
+from tensorflow.keras.layers import Layer, Conv2D, BatchNormalization, \
+    UpSampling2D, concatenate, Input
 from tensorflow.keras.activations import tanh
 
+try:
+    import nv_norms
+except ImportError:
+    nv_norms = None
+
 
 INPUT_SHAPE = (256, 256, 3)
+# weights are initialized from N(0, 0.02) as in the CycleGAN paper
+_INIT = tf.random_normal_initializer(0., 0.02)
+
+
+def _has_bfloat16_gpu():
+    # bfloat16 Tensor Cores need compute capability 8.0 (Ampere) or newer
+    for gpu in tf.config.list_physical_devices("GPU"):
+        details = tf.config.experimental.get_device_details(gpu)
+        if details.get("compute_capability", (0, 0)) >= (8, 0):
+            return True
+    return False
+
+
+# bfloat16 runs the convolutions on Tensor Cores without the loss scaling
+# float16 would need. The last layers of the models are kept in float32.
+# A policy already chosen by the importing code is left as it is.
+if (tf.keras.mixed_precision.global_policy().name == "float32" and
+        _has_bfloat16_gpu()):
+    tf.keras.mixed_precision.set_global_policy("mixed_bfloat16")
+
+# All the layers are NHWC. Let Grappler keep that layout and fuse
+# Conv2D + BiasAdd + Activation instead of inserting transposes.
+tf.keras.backend.set_image_data_format("channels_last")
+tf.config.optimizer.set_experimental_options({"layout_optimizer": True,
+                                              "remapping": True,
+                                              "arithmetic_optimization": True,
+                                              "constant_folding": True})
+
+# convolutions kept in float32 (e.g. the last layers of the models) still
+# run on Tensor Cores through TF32
+tf.config.experimental.enable_tensor_float_32_execution(True)
 
 
 class InstanceNormalization(Layer):
     """
     Instance Normalization Layer (https://arxiv.org/abs/1607.08022).
 
+    With `use_nv_norms`, the fused kernel from nv_norms, which computes the
+    moments, normalization and affine transform in one pass on NVIDIA GPUs,
+    is used instead. Only layers created with that flag use it. XLA cannot
+    compile nv_norms kernels, so the models in this module never set it:
+    their calls are jit-compiled, and the residual blocks call
+    instance_norm directly.
+
     Args:
         epsilon: a small positive decimal number to avoid dividing by 0
+   use_nv_norms: If True, use nv_norms. Not usable inside an XLA cluster
     """
 
-    def __init__(self, epsilon=1e-5):
+    def __init__(self, epsilon=1e-5, use_nv_norms=False):
         super(InstanceNormalization, self).__init__()
         self.epsilon = epsilon
+        self.use_nv_norms = use_nv_norms
+        if use_nv_norms:
+            if nv_norms is None:
+                raise ImportError("arg `use_nv_norms` requires the nv_norms "
+                                  "package, which is not installed")
+            # same initializers as the fallback weights built in `build`
+            self.fused_norm = nv_norms.InstanceNormalization(
+                axis=-1,
+                epsilon=epsilon,
+                center=True,
+                scale=True,
+                gamma_initializer=_INIT,
+                beta_initializer="zeros")
     
     def build(self, input_shape):
+        if self.use_nv_norms:
+            return
         self.scale = self.add_weight(name="scale",
                                      shape=input_shape[-1:],
-                                     initializer=tf.random_normal_initializer(0., 0.02),
+                                     initializer=_INIT,
                                      trainable=True)
 
         self.offset = self.add_weight(name="offset",
@@ -32,58 +97,250 @@ class InstanceNormalization(Layer):
                                       trainable=True)
 
     def call(self, x):
-        mean, variance = tf.nn.moments(x, axes=[1, 2], keepdims=True)
-        inv = tf.math.rsqrt(variance + self.epsilon)
-        normalized = (x - mean) * inv
-        return self.scale * normalized + self.offset
+        if self.use_nv_norms:
+            return self.fused_norm(x)
+        return instance_norm(x, self.scale, self.offset, self.epsilon)
+
+
+def instance_norm(x, scale, offset, epsilon=1e-5):
+    # the moments are reduced in float32 to keep them accurate under
+    # mixed precision. E[x] and E[x^2] are taken from the same read of x so
+    # that XLA can compute both in a single pass.
+    x_32 = tf.cast(x, tf.float32)
+    mean = tf.reduce_mean(x_32, axis=[1, 2], keepdims=True)
+    mean_sq = tf.reduce_mean(tf.square(x_32), axis=[1, 2], keepdims=True)
+    variance = tf.maximum(mean_sq - tf.square(mean), 0.)
+    inv = tf.math.rsqrt(variance + epsilon)
+    normalized = tf.cast((x_32 - mean) * inv, x.dtype)
+    return tf.cast(scale, x.dtype) * normalized + tf.cast(offset, x.dtype)
+
+
+@tf.function(jit_compile=True)
+def reflect_conv(x, kernel, strides=1, pad_spec=None, padding="VALID",
+                 bias=None, activation=None):
+    """
+    Reflection padding -> Conv2D -> BiasAdd -> Activation compiled together as
+    one XLA cluster. Unlike zero padding, reflection padding cannot be folded
+    into the convolution window, so the padded tensor is still written before
+    the convolution runs.
 
+    Args:
+         kernel: convolution kernel of shape (size, size, in, out)
+       pad_spec: paddings of tf.pad given as a nested tuple. No padding if None
+           bias: bias of shape (out,). No bias if None
+     activation: activation function applied last. No activation if None
+    """
+    if pad_spec is not None:
+        x = tf.pad(x, pad_spec, "REFLECT")
+    x = tf.nn.conv2d(x,
+                     tf.cast(kernel, x.dtype),
+                     strides,
+                     padding,
+                     data_format="NHWC")
+    if bias is not None:
+        x = tf.nn.bias_add(x, tf.cast(bias, x.dtype), data_format="NHWC")
+    if activation is not None:
+        x = activation(x)
+    return x
+
+
+@tf.function(jit_compile=True)
+def fused_conv_in_relu(x, kernel, scale, offset, strides=1, pad_spec=None,
+                       padding="VALID", relu=True, epsilon=1e-5):
+    """
+    Reflection padding -> Conv2D -> InstanceNorm -> ReLU compiled as a single
+    XLA cluster, so that the instance norm and ReLU are fused into one pass
+    over the convolution output. The reflection padded inputs are still
+    written before the convolution (see reflect_conv).
 
-class ResNetBlock(Layer):
-    # Define ResNet block
+    Args:
+         kernel: convolution kernel of shape (size, size, in, out)
+          scale: instance norm scale of shape (out,)
+         offset: instance norm offset of shape (out,)
+       pad_spec: paddings of tf.pad given as a nested tuple. No padding if None
+           relu: If True, apply ReLU after the normalization
+    """
+    x = reflect_conv(x, kernel, strides, pad_spec, padding)
+    x = instance_norm(x, scale, offset, epsilon)
+    if relu:
+        x = tf.nn.relu(x)
+    return x
 
-    def __init__(self,
-                 filters, 
-                 size=3, 
-                 strides=1, 
-                 padding="valid", 
-                 name="resnetblock"):
 
-        super(ResNetBlock, self).__init__()
-        initializer = tf.random_normal_initializer(0., 0.02)
+@tf.function(jit_compile=True)
+def res_step(x, kernels, scales, offsets, pad_spec):
+    """
+    Residual block applied with raw weights:
+    x + (Conv2D -> InstanceNorm -> ReLU -> Conv2D -> InstanceNorm)(x)
+
+    Args:
+        kernels: kernels of the two convolutions
+         scales: scales of the two instance norms
+        offsets: offsets of the two instance norms
+       pad_spec: reflection paddings applied before each convolution
+    """
+    y = fused_conv_in_relu(x, kernels[0], scales[0], offsets[0], 1, pad_spec)
+    y = fused_conv_in_relu(y,
+                           kernels[1],
+                           scales[1],
+                           offsets[1],
+                           1,
+                           pad_spec,
+                           relu=False)
+    return x + y
+
+
+class ResNetBlocks(Layer):
+    """
+    Sequence of residual blocks, each of which contains two 3 × 3 convolutional
+    layers with the same number of filters on both layer. The weights of all
+    the blocks are packed into single variables, so that they are stored
+    contiguously and every block is run by the same compiled res_step.
+
+     Args:
+        filters: number of filters. Has to match the number of input channels
+     num_blocks: number of residual blocks
+           size: filter size
+           name: name of the layer
+    """
+
+    def __init__(self,
+                 filters,
+                 num_blocks=9,
+                 size=3,
+                 name="resnetblocks"):
+
+        super(ResNetBlocks, self).__init__(name=name)
+        self.filters = filters
+        self.num_blocks = num_blocks
         self.size = size
-        self.conv2d_1 = Conv2D(filters, 
-                               size, 
-                               strides, 
-                               padding=padding,
-                               kernel_initializer=initializer,
-                               use_bias=False)
-        self.instance_norm_1 = InstanceNormalization()
-        self.ReLU = ReLU()
-        self.conv2d_2 = Conv2D(filters,
-                               size,
-                               strides,
-                               padding=padding,
-                               kernel_initializer=initializer,
-                               use_bias=False)
-        self.instance_norm_2 = InstanceNormalization()
-
-        
+        pad = (size - 1) // 2
+        # kept as a tuple so that it is hashable and traced as a constant
+        self.pad_spec = ((0, 0), (pad, pad), (pad, pad), (0, 0))
+
+    def build(self, input_shape):
+        initializer = _INIT
+        self.kernels = self.add_weight(name="kernels",
+                                       shape=(self.num_blocks,
+                                              2,
+                                              self.size,
+                                              self.size,
+                                              self.filters,
+                                              self.filters),
+                                       initializer=initializer,
+                                       trainable=True)
+        self.scales = self.add_weight(name="scales",
+                                      shape=(self.num_blocks,
+                                             2,
+                                             self.filters),
+                                      initializer=initializer,
+                                      trainable=True)
+        self.offsets = self.add_weight(name="offsets",
+                                       shape=(self.num_blocks,
+                                              2,
+                                              self.filters),
+                                       initializer="zeros",
+                                       trainable=True)
+
     def call(self, inputs):
-        pad = int((self.size - 1) / 2)
+        # Unstack the weights once, so that their gradients are gathered by a
+        # single stack rather than a dense gradient per sliced block
+        kernels = tf.unstack(tf.reshape(self.kernels,
+                                        (2 * self.num_blocks,
+                                         self.size,
+                                         self.size,
+                                         self.filters,
+                                         self.filters)))
+        scales = tf.unstack(tf.reshape(self.scales,
+                                       (2 * self.num_blocks, self.filters)))
+        offsets = tf.unstack(tf.reshape(self.offsets,
+                                        (2 * self.num_blocks, self.filters)))
+        x = inputs
         # Reflection padding was used to reduce artifacts
-        x = tf.pad(inputs, [[0, 0], [pad, pad], [pad, pad], [0, 0]], "REFLECT")
-        x = self.conv2d_1(x)
-        x = self.instance_norm_1(x)
-        x = self.ReLU(x)
-        x = tf.pad(x, [[0, 0], [pad, pad], [pad, pad], [0, 0]], "REFLECT")
-        x = self.conv2d_2(x)
-        x = self.instance_norm_2(x)
-        return x + inputs
+        for i in range(0, 2 * self.num_blocks, 2):
+            x = res_step(x,
+                         kernels[i:i + 2],
+                         scales[i:i + 2],
+                         offsets[i:i + 2],
+                         self.pad_spec)
+        return x
+
+
+class PaddedConv2D(Conv2D):
+    """
+    Conv2D which pads its own inputs. Zero padding is passed to the
+    convolution op itself, so no padded copy of the inputs is written like
+    ZeroPadding2D does. With reflection padding, the pad, convolution, bias
+    add and activation are compiled together by reflect_conv, which still
+    writes the padded inputs.
+
+    Args:
+        filters: number of filters
+    kernel_size: filter size
+            pad: number of pixels padded on each side of height and width
+           mode: padding mode. Either "CONSTANT" (zeros) or "REFLECT"
+    """
+
+    def __init__(self, filters, kernel_size, pad=1, mode="CONSTANT", **kwargs):
+        super(PaddedConv2D, self).__init__(filters,
+                                           kernel_size,
+                                           padding="valid",
+                                           data_format="channels_last",
+                                           **kwargs)
+        if mode.upper() not in ("CONSTANT", "REFLECT"):
+            raise ValueError("arg `mode` has to be either constant "
+                             "or reflect. What you specified is "
+                             "{}".format(mode))
+        self.pad = pad
+        self.mode = mode.upper()
+        self.pad_spec = ((0, 0), (pad, pad), (pad, pad), (0, 0))
+
+    def call(self, inputs):
+        if self.mode == "REFLECT":
+            return reflect_conv(inputs,
+                                self.kernel,
+                                self.strides,
+                                self.pad_spec,
+                                bias=self.bias if self.use_bias else None,
+                                activation=self.activation)
+        x = tf.nn.conv2d(inputs,
+                         self.kernel,
+                         self.strides,
+                         self.pad_spec,
+                         data_format="NHWC")
+        if self.use_bias:
+            x = tf.nn.bias_add(x, self.bias, data_format="NHWC")
+        return self.activation(x)
+
+    def compute_output_shape(self, input_shape):
+        input_shape = tf.TensorShape(input_shape).as_list()
+        for axis in (1, 2):
+            if input_shape[axis] is not None:
+                input_shape[axis] += 2 * self.pad
+        return super(PaddedConv2D, self).compute_output_shape(input_shape)
+
+    def get_config(self):
+        config = super(PaddedConv2D, self).get_config()
+        # padding and data_format are fixed by __init__
+        del config["padding"]
+        del config["data_format"]
+        config.update({"pad": self.pad, "mode": self.mode})
+        return config
+
+
+def get_conv2d(filters, size, padding, pad_mode="constant", **kwargs):
+    if isinstance(padding, int):
+        return PaddedConv2D(filters, size, pad=padding, mode=pad_mode, **kwargs)
+    return Conv2D(filters,
+                  size,
+                  padding=padding,
+                  data_format="channels_last",
+                  **kwargs)
 
 
 def get_norm_layer(norm_type):
     if norm_type.lower() == "batchnorm":
-        return BatchNormalization()
+        return BatchNormalization(momentum=0.9, epsilon=1e-5, fused=True)
     elif norm_type.lower() == "instancenorm":
         return InstanceNormalization()
     else:
@@ -93,16 +350,18 @@ def get_norm_layer(norm_type):
 
 
 def get_activation(activation):
+    # plain ops instead of stateless layers so that Grappler can fuse them
+    # into the preceding op
     if activation.lower() == "relu":
-        return ReLU()
+        return tf.nn.relu
     elif activation.lower() == "lrelu":
-        return LeakyReLU(0.2)
+        return partial(tf.nn.leaky_relu, alpha=0.2)
     elif activation.lower() == "tanh":
         return tanh
     else:
-        raise ValueError("arg `norm_type` has to be either relu "
+        raise ValueError("arg `activation` has to be either relu, lrelu "
                          "or tanh. What you specified is "
-                         "{}".format(norm_type))
+                         "{}".format(activation))
 
 
 class Downsample(Layer):
@@ -112,6 +371,8 @@ class Downsample(Layer):
      Args:
         filters: number of filters
            size: filter size
+        padding: "same", "valid" or the number of pixels padded on each side
+       pad_mode: mode of an int padding. Either "constant" (zeros) or "reflect"
       norm_type: normalization type. Either "batchnorm", "instancenorm" or None
            name: name of the layer
 
@@ -124,31 +385,34 @@ class Downsample(Layer):
                  size,
                  strides=1,
                  padding="same",
+                 pad_mode="constant",
                  norm_type="batchnorm",
                  activation="lrelu",
                  name="downsample", 
                  **kwargs):
 
         super(Downsample, self).__init__(name=name, **kwargs)
-        initializer = tf.random_normal_initializer(0., 0.02)
+        initializer = _INIT
         self.norm_type = norm_type
         use_bias = False
         if self.norm_type:
             self.norm_layer = get_norm_layer(norm_type)
         else:
             use_bias = True
-        self.conv2d = Conv2D(filters,
-                             size,
-                             strides=strides,
-                             padding=padding,
-                             kernel_initializer=initializer,
-                             use_bias=use_bias)
+        self.conv2d = get_conv2d(filters,
+                                 size,
+                                 padding,
+                                 pad_mode=pad_mode,
+                                 strides=strides,
+                                 kernel_initializer=initializer,
+                                 use_bias=use_bias,
+                                 activation=None)
         self.activation = get_activation(activation)
 
-    def call(self, inputs):
+    def call(self, inputs, training=False):
         x = self.conv2d(inputs)
         if self.norm_type:
-            x = self.norm_layer(x)
+            x = self.norm_layer(x, training=training)
         x = self.activation(x)
 
         return x
@@ -156,13 +420,18 @@ class Downsample(Layer):
 
 class Upsample(Layer):
     """
-    Conv2DTranspose -> BatchNorm(or InstanceNorm) -> Dropout -> ReLU
+    Nearest neighbor upsampling -> Conv2D -> BatchNorm(or InstanceNorm)
+    -> Dropout -> ReLU
+
+    Resize followed by a convolution avoids the checkerboard artifacts of
+    Conv2DTranspose (https://distill.pub/2016/deconv-checkerboard/).
 
      Args:
         filters: number of filters
            size: filter size
+        strides: upsampling factor
       norm_type: normalization type. Either "batchnorm", "instancenorm" or None
-  apply_dropout: If True, apply the dropout layer
+  apply_dropout: If True, apply dropout while training
            name: name of the layer
 
     Return:
@@ -180,7 +449,7 @@ class Upsample(Layer):
                  **kwargs):
 
         super(Upsample, self).__init__(name=name, **kwargs)
-        initializer = tf.random_normal_initializer(0., 0.02)
+        initializer = _INIT
         self.norm_type = norm_type
         use_bias = False
         if self.norm_type:
@@ -188,22 +457,27 @@ class Upsample(Layer):
         else:
             use_bias = True
         self.apply_dropout = apply_dropout
-        self.conv2dtranspose = Conv2DTranspose(filters,
-                                               size,
-                                               strides=strides,
-                                               padding=padding,
-                                               kernel_initializer=initializer,
-                                               use_bias=use_bias)
-        if apply_dropout:
-            self.dropout = Dropout(0.5)
+        self.upsampling2d = UpSampling2D(strides,
+                                         data_format="channels_last",
+                                         interpolation="nearest")
+        self.conv2d = get_conv2d(filters,
+                                 size,
+                                 padding,
+                                 strides=1,
+                                 kernel_initializer=initializer,
+                                 use_bias=use_bias,
+                                 activation=None)
         self.activation = get_activation(activation)
 
-    def call(self, inputs):
-        x = self.conv2dtranspose(inputs)
+    def call(self, inputs, training=False):
+        x = self.upsampling2d(inputs)
+        x = self.conv2d(x)
         if self.norm_type:
-            x = self.norm_layer(x)
-        if self.apply_dropout:
-            x = self.dropout(x)
+            x = self.norm_layer(x, training=training)
+        # tf.nn.dropout lets XLA fuse the random mask into the activation
+        # instead of materializing it as Dropout does
+        if self.apply_dropout and training:
+            x = tf.nn.dropout(x, rate=0.5)
         x = self.activation(x)
 
         return x
@@ -236,8 +510,12 @@ class Discriminator(Model):
                  name="discriminator",
                  **kwargs):
 
-        super(Discriminator, self).__init__(name=name, **kwargs)
-        initializer = tf.random_normal_initializer(0., 0.02)
+        # inputs stay float32 to match the input signature of the compiled
+        # calls; the sublayers cast them to the compute dtype themselves
+        super(Discriminator, self).__init__(name=name, autocast=False, **kwargs)
+        initializer = _INIT
+        self.first_filters = first_filters
+        self.size = size
         self.norm_type = norm_type
         self.downsample_1 = Downsample(first_filters, 
                                        size,
@@ -260,39 +538,136 @@ class Discriminator(Model):
                                        norm_type=norm_type,
                                        activation="lrelu",
                                        name="downsample_3")
-        self.zeropadding2d_1 = ZeroPadding2D()
         self.downsample_4 = Downsample(first_filters * 8, 
                                        size, 
                                        strides=1,
-                                       padding="valid",
+                                       padding=1,
                                        norm_type=norm_type,
                                        activation="lrelu",
                                        name="downsample_4")
-        self.zeropadding2d_2 = ZeroPadding2D()
-        self.conv2d = Conv2D(1, 
-                             size, 
-                             strides=1,
-                             padding="valid",
-                             kernel_initializer=initializer)
-
-    def call(self, inputs):
+        self.conv2d = PaddedConv2D(1, 
+                                   size, 
+                                   pad=1,
+                                   strides=1,
+                                   kernel_initializer=initializer,
+                                   dtype="float32")
+
+    def call(self, inputs, training=False):
+        # `training` picks one of two compiled functions in Python, so that
+        # each graph only contains the ops of its own mode
+        if training:
+            return self._train_call(inputs)
+        return self._inference_call(inputs)
+
+    @tf.function(jit_compile=True,
+                 input_signature=[tf.TensorSpec((None,) + INPUT_SHAPE,
+                                                tf.float32)])
+    def _train_call(self, inputs):
+        return self._forward(inputs, training=True)
+
+    @tf.function(jit_compile=True,
+                 input_signature=[tf.TensorSpec((None,) + INPUT_SHAPE,
+                                                tf.float32)])
+    def _inference_call(self, inputs):
+        return self._forward(inputs, training=False)
+
+    def _forward(self, inputs, training=False):
         # inputs: (bs, 256, 256, input channels)
-        x = self.downsample_1(inputs) # (bs, 128, 128, first_filters)
-        x = self.downsample_2(x) # (bs, 64, 64, first_filters * 2)
-        x = self.downsample_3(x) # (bs, 32, 32, first_filters * 4)
-        x = self.zeropadding2d_1(x) # (bs, 34, 34, first_filters * 4)
-        x = self.downsample_4(x) # (bs, 31, 31, first_filters * 8)
-        x = self.zeropadding2d_2(x) # (bs, 33, 33, first_filters * 8)
+        x = self.downsample_1(inputs, training=training) # (bs, 128, 128, first_filters)
+        x = self.downsample_2(x, training=training) # (bs, 64, 64, first_filters * 2)
+        x = self.downsample_3(x, training=training) # (bs, 32, 32, first_filters * 4)
+        # both convs below zero pad their inputs by 1 on each side
+        x = self.downsample_4(x, training=training) # (bs, 31, 31, first_filters * 8)
         x = self.conv2d(x) # (bs, 30, 30, 1)
 
         return x
 
     def summary(self):
         x = Input(shape=INPUT_SHAPE)
-        model = Model(inputs=[x], outputs=self.call(x))
+        # the compiled calls are tf.functions, so trace the forward pass itself
+        model = Model(inputs=[x], outputs=self._forward(x))
         return model.summary()
 
 
+def build_trt_discriminator(discriminator,
+                            calibration_ds,
+                            saved_model_dir=None,
+                            max_workspace_size_bytes=1 << 30):
+    """
+    Convert a trained discriminator into an INT8 TF-TRT function for
+    evaluation, where each Conv2D -> LeakyReLU runs as a fused TensorRT layer.
+
+    Args:
+               discriminator: trained Discriminator model
+              calibration_ds: dataset of input image batches used to calibrate
+                              the INT8 ranges
+             saved_model_dir: directory the discriminator is exported to.
+                              If None, a temporary directory is used and
+                              removed once the conversion is done
+    max_workspace_size_bytes: maximum GPU memory TensorRT may use for a layer
+
+    Return:
+        Converted function which returns {"output_0": (bs, 30, 30, 1) output}
+    """
+    # TensorRT does not convert bfloat16 ops, so rebuild the discriminator
+    # in float32 and copy the trained weights over
+    policy = tf.keras.mixed_precision.global_policy()
+    tf.keras.mixed_precision.set_global_policy("float32")
+    try:
+        float32_discriminator = Discriminator(
+            first_filters=discriminator.first_filters,
+            size=discriminator.size,
+            norm_type=discriminator.norm_type,
+            name=discriminator.name)
+    finally:
+        tf.keras.mixed_precision.set_global_policy(policy)
+    float32_discriminator(tf.zeros((1,) + INPUT_SHAPE))
+    float32_discriminator.set_weights(discriminator.get_weights())
+
+    if saved_model_dir is None:
+        # calibration runs inside convert(), so the SavedModel is not needed
+        # once it returns
+        with tempfile.TemporaryDirectory(
+                prefix="trt_discriminator_") as saved_model_dir:
+            return _convert_to_trt(float32_discriminator,
+                                   calibration_ds,
+                                   saved_model_dir,
+                                   max_workspace_size_bytes)
+    return _convert_to_trt(float32_discriminator,
+                           calibration_ds,
+                           saved_model_dir,
+                           max_workspace_size_bytes)
+
+
+def _convert_to_trt(discriminator,
+                    calibration_ds,
+                    saved_model_dir,
+                    max_workspace_size_bytes):
+    # export the uncompiled forward pass, since TensorRT cannot convert the ops
+    # inside an XLA cluster
+    serving_fn = tf.function(discriminator._forward,
+                             input_signature=[tf.TensorSpec((None,) + INPUT_SHAPE,
+                                                            tf.float32)])
+    tf.saved_model.save(discriminator,
+                        saved_model_dir,
+                        signatures=serving_fn.get_concrete_function())
+
+    conversion_params = tf.experimental.tensorrt.ConversionParams(
+        precision_mode="INT8",
+        max_workspace_size_bytes=max_workspace_size_bytes,
+        minimum_segment_size=3,
+        use_calibration=True)
+    converter = tf.experimental.tensorrt.Converter(
+        input_saved_model_dir=saved_model_dir,
+        conversion_params=conversion_params)
+
+    def calibration_input_fn():
+        for imgs in calibration_ds:
+            yield (imgs,)
+
+    return converter.convert(calibration_input_fn=calibration_input_fn)
+
+
 """
 class Pix2Pix(Model):
     
@@ -373,6 +748,7 @@ class ResNetGenerator(Model):
     Args:
     output_channels: number of output channels
           norm_type: normalization type. Either "batchnorm", "instancenorm" or None
+  num_resnet_blocks: number of residual blocks. Either 6 or 9
 
     Return:
         Generator model
@@ -381,15 +757,22 @@ class ResNetGenerator(Model):
                  first_filters=64,
                  output_channels=3,
                  norm_type="instancenorm", 
+                 num_resnet_blocks=9,
                  name="resnet_generator",
                  **kwargs):
 
-        super(ResNetGenerator, self).__init__(name=name, **kwargs)
-        initializer = tf.random_normal_initializer(0., 0.02)
+        # inputs stay float32 to match the input signature of the compiled
+        # calls; the sublayers cast them to the compute dtype themselves
+        super(ResNetGenerator, self).__init__(name=name,
+                                              autocast=False,
+                                              **kwargs)
+        initializer = _INIT
+        # Reflection padding was used to reduce artifacts
         self.downsample_1 = Downsample(first_filters, 
                                        7,
                                        strides=1,
-                                       padding="valid",
+                                       padding=3,
+                                       pad_mode="reflect",
                                        norm_type="instancenorm", 
                                        name="downsample_1")
         self.downsample_2 = Downsample(first_filters*2, 
@@ -402,15 +785,9 @@ class ResNetGenerator(Model):
                                        strides=2,
                                        norm_type="instancenorm", 
                                        name="downsample_3")
-        self.resnetblock_1 = ResNetBlock(first_filters*4, name="resnetblock_1")
-        self.resnetblock_2 = ResNetBlock(first_filters*4, name="resnetblock_2")
-        self.resnetblock_3 = ResNetBlock(first_filters*4, name="resnetblock_3")
-        self.resnetblock_4 = ResNetBlock(first_filters*4, name="resnetblock_4")
-        self.resnetblock_5 = ResNetBlock(first_filters*4, name="resnetblock_5")
-        self.resnetblock_6 = ResNetBlock(first_filters*4, name="resnetblock_6")
-        self.resnetblock_7 = ResNetBlock(first_filters*4, name="resnetblock_7")
-        self.resnetblock_8 = ResNetBlock(first_filters*4, name="resnetblock_8")
-        self.resnetblock_9 = ResNetBlock(first_filters*4, name="resnetblock_9")
+        self.resnet_blocks = ResNetBlocks(first_filters*4,
+                                          num_blocks=num_resnet_blocks,
+                                          name="resnet_blocks")
         self.upsample_1 = Upsample(first_filters*2, 
                                    3,
                                    2,
@@ -423,31 +800,43 @@ class ResNetGenerator(Model):
                                    padding="same",
                                    norm_type="instancenorm",
                                    name="upsample_2")
-        self.last_conv2d = Conv2D(output_channels, 
-                                  7,
-                                  1,
-                                  padding="valid",
-                                  activation="tanh",
-                                  name="last_conv2d")
-
-    def call(self, inputs):
-        # Reflection padding was used to reduce artifacts
-        x = tf.pad(inputs, [[0, 0], [3, 3], [3, 3], [0, 0]], "REFLECT")
-        x = self.downsample_1(x)
-        x = self.downsample_2(x)
-        x = self.downsample_3(x)
-        x = self.resnetblock_1(x)
-        x = self.resnetblock_2(x)
-        x = self.resnetblock_3(x)
-        x = self.resnetblock_4(x)
-        x = self.resnetblock_5(x)
-        x = self.resnetblock_6(x)
-        x = self.resnetblock_7(x)
-        x = self.resnetblock_8(x)
-        x = self.resnetblock_9(x)
-        x = self.upsample_1(x)
-        x = self.upsample_2(x)
-        x = tf.pad(x, [[0, 0], [3, 3], [3, 3], [0, 0]], "REFLECT")
+        self.last_conv2d = PaddedConv2D(output_channels, 
+                                        7,
+                                        pad=3,
+                                        mode="REFLECT",
+                                        strides=1,
+                                        activation="tanh",
+                                        dtype="float32",
+                                        name="last_conv2d")
+
+    def call(self, inputs, training=False):
+        # `training` picks one of two compiled functions in Python, so that
+        # each graph only contains the ops of its own mode
+        if training:
+            return self._train_call(inputs)
+        return self._inference_call(inputs)
+
+    @tf.function(jit_compile=True,
+                 input_signature=[tf.TensorSpec((None,) + INPUT_SHAPE,
+                                                tf.float32)])
+    def _train_call(self, inputs):
+        return self._forward(inputs, training=True)
+
+    @tf.function(jit_compile=True,
+                 input_signature=[tf.TensorSpec((None,) + INPUT_SHAPE,
+                                                tf.float32)])
+    def _inference_call(self, inputs):
+        return self._forward(inputs, training=False)
+
+    def _forward(self, inputs, training=False):
+        # downsample_1 reflection pads its inputs by 3 itself
+        x = self.downsample_1(inputs, training=training)
+        x = self.downsample_2(x, training=training)
+        x = self.downsample_3(x, training=training)
+        x = self.resnet_blocks(x)
+        x = self.upsample_1(x, training=training)
+        x = self.upsample_2(x, training=training)
+        # last_conv2d reflection pads its inputs by 3 itself
         result = self.last_conv2d(x)
 
         return result
@@ -459,5 +848,6 @@ class ResNetGenerator(Model):
     """
     def summary(self):
         x = Input(shape=INPUT_SHAPE)
-        model = Model(inputs=[x], outputs=self.call(x))
+        # the compiled calls are tf.functions, so trace the forward pass itself
+        model = Model(inputs=[x], outputs=self._forward(x))
         return model.summary()
\ No newline at end of file